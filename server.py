@@ -96,6 +96,11 @@ parser.add_argument(
     type=str, help="If THA3 models are not yet installed, use the given HuggingFace repository to install them. Defaults to OktayAlpk/talking-head-anime-3.",
     default="OktayAlpk/talking-head-anime-3"
 )
+parser.add_argument(
+    "--talkinghead-format", type=str, help="Image format for the talkinghead video stream. 'png' (default) is lossless; 'webp' encodes faster and sends less data; 'raw' sends uncompressed RGBA frames, for custom clients only.",
+    required=False, default="png",
+    choices=["png", "webp", "raw"],
+)
 
 parser.add_argument("--coqui-gpu", action="store_true", help="Run the voice models on the GPU (CPU is default)")
 parser.add_argument("--coqui-models", help="Install given Coqui-api TTS model at launch (comma separated list, last one will be loaded at start)")
@@ -217,6 +222,10 @@ if "talkinghead" in modules:
     if model == "auto":  # default
         # FP16 boosts the rendering performance by ~1.5x, but is only supported on GPU.
         model = "separable_half" if args.talkinghead_gpu else "separable_float"
+    elif model.endswith("_half") and not args.talkinghead_gpu:
+        fallback_model = model.replace("_half", "_float")
+        print(f"{Fore.YELLOW}{Style.BRIGHT}talkinghead: FP16 model {model} is only supported on GPU, using {fallback_model} instead.{Style.RESET_ALL}")
+        model = fallback_model
     print(f"Initializing talkinghead pipeline in {mode} mode with model {model}....")
     talkinghead_path = os.path.abspath(os.path.join(os.getcwd(), "talkinghead"))
     sys.path.append(talkinghead_path) # Add the path to the 'tha3' module to the sys.path list
@@ -226,7 +235,7 @@ if "talkinghead" in modules:
         def launch_talkinghead():
             # mode: choices='The device to use for PyTorch ("cuda" for GPU, "cpu" for CPU).'
             # model: choices=['standard_float', 'separable_float', 'standard_half', 'separable_half'],
-            talkinghead.launch(mode, model)
+            talkinghead.launch(mode, model, args.talkinghead_format)
         talkinghead_thread = threading.Thread(target=launch_talkinghead)
         talkinghead_thread.daemon = True  # Set the thread as a daemon thread
         talkinghead_thread.start()
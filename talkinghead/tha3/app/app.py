@@ -9,17 +9,35 @@ If you want to play around with THA3 expressions in a standalone app, see `manua
 import atexit
 import io
 import logging
-import math
 import os
-import random
+import struct
 import sys
 import time
 import numpy as np
 import threading
-from typing import Dict, List, NoReturn, Optional, Union
+from typing import Dict, NoReturn, Optional, Tuple, Union
 
 import PIL
 
+# Optional, faster PNG encoders. We use the first one that is available, falling back to Pillow.
+#
+# Having an optional package installed must never break the stream, so each one is probed once here with a tiny encode,
+# and disabled if it can't actually encode PNG in this environment.
+try:
+    import pyspng
+    # The pyspng releases on PyPI (up to 0.1.4) can only decode; `encode` exists only in newer builds from the GitHub repository.
+    pyspng.encode(np.zeros((1, 1, 4), dtype=np.uint8), compress_level=1)
+except Exception:
+    pyspng = None
+try:
+    import imagecodecs
+    # imagecodecs may have been built without its PNG codec.
+    if not imagecodecs.PNG.available:
+        raise ImportError("imagecodecs: PNG codec not available")
+    imagecodecs.png_encode(np.zeros((1, 1, 4), dtype=np.uint8), level=1)
+except Exception:
+    imagecodecs = None
+
 import torch
 
 from flask import Flask, Response
@@ -30,7 +48,7 @@ from tha3.poser.poser import Poser
 from tha3.util import (torch_linear_to_srgb, resize_PIL_image,
                        extract_PIL_image_from_filelike, extract_pytorch_image_from_PIL_image)
 from tha3.app.postprocessor import Postprocessor
-from tha3.app.util import posedict_keys, posedict_key_to_index, load_emotion_presets, posedict_to_pose, to_talkinghead_image, RunningAverage
+from tha3.app.util import posedict_keys, posedict_key_to_index, load_emotion_presets, posedicts_to_pose_matrix, to_talkinghead_image, RunningAverage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -41,9 +59,8 @@ logger = logging.getLogger(__name__)
 talkinghead_basedir = "talkinghead"
 
 global_animator_instance = None
-_animator_output_lock = threading.Lock()  # protect from concurrent access to `result_image` and the `new_frame_available` flag.
 global_encoder_instance = None
-global_latest_frame_sent = None
+_encoder_cond = threading.Condition()  # notified by the encoder whenever it publishes a new frame in `latest_frame`.
 
 # These need to be written to by the API functions.
 #
@@ -84,7 +101,7 @@ def setEmotion(_emotion: Dict[str, float]) -> None:
     # Never triggered currently, because `setSpriteSlashCommand` at the client end (`SillyTavern/public/scripts/extensions/expressions/index.js`)
     # searches for a static sprite for the given expression, and does not proceed to `sendExpressionCall` if not found.
     # So beside `talkinghead.png`, your character also needs the static sprites for "/emote xxx" to work.
-    if highest_label not in global_animator_instance.emotions:
+    if highest_label not in global_animator_instance.emotion_index:
         logger.warning(f"setEmotion: emotion '{highest_label}' does not exist, setting to 'neutral'")
         highest_label = "neutral"
 
@@ -146,10 +163,11 @@ def stop_talking() -> str:
 #     - The network thread waits for the encoder to publish a frame, and then starts normal operation.
 #   - In normal operation (after startup):
 #     - The animator waits until the encoder has consumed the previous published frame. Then it proceeds to render and publish a new frame.
-#       - This communication is handled through the flag `animator.new_frame_available`.
+#       - This communication is handled through the events `animator.frame_produced` and `animator.frame_consumed`,
+#         and the frame counter `animator.frame_id`. No lock is needed; see `render_animation_frame` for the details.
 #     - The network thread does its own thing on a regular schedule, based on the desired target FPS.
 #       - However, the network thread publishes metadata on which frame is the latest that has been sent over the network at least once.
-#         This is stored as an `id` (i.e. memory address) in `global_latest_frame_sent`.
+#         This is reported to the encoder by calling `encoder.on_frame_sent` with the sequence number (`frame_seq`) of the frame.
 #       - If the target FPS is too high for the animator and/or encoder to keep up with, the network thread re-sends
 #         the latest frame published by the encoder as many times as necessary, to keep the network output at the target FPS
 #         regardless of render/encode speed. This handles the case of hardware slower than the target FPS.
@@ -159,12 +177,13 @@ def stop_talking() -> str:
 #       rate-limited by the encoder consuming its frames). This handles the case of hardware faster than the target FPS.
 #     - When the animator and encoder are fast enough to keep up with the target FPS, generally when frame N is being sent,
 #       frame N+1 is being encoded (or is already encoded, and waiting for frame N to be sent), and frame N+2 is being rendered.
+#     - Hence the encode of frame N+1 already overlaps the send of frame N. Offloading the encode to a pool of worker threads would not
+#       help: to keep more than one encode in flight, the encoder would have to take frames from the animator before the previous ones
+#       have been sent, which defeats the backpressure above.
 #
 def result_feed() -> Response:
-    """Return a Flask `Response` that repeatedly yields the current image as 'image/png'."""
+    """Return a Flask `Response` that repeatedly yields the current image, in the encoder's output format."""
     def generate():
-        global global_latest_frame_sent
-
         last_frame_send_complete_time = None
         last_report_time = None
         send_duration_sec = 0.0
@@ -172,16 +191,18 @@ def result_feed() -> Response:
 
         while True:
             # Send the latest available animation frame.
-            # Important: grab reference to `image_bytes` only once, since it will be atomically updated without a lock.
-            image_bytes = global_encoder_instance.image_bytes
-            if image_bytes is not None:
+            # Important: grab reference to `latest_frame` only once, since it will be atomically updated without a lock.
+            # The sequence number and the image are published together, so they always match.
+            latest_frame = global_encoder_instance.latest_frame
+            if latest_frame is not None:
+                frame_seq, image_bytes = latest_frame
                 # How often should we send?
                 #  - Excessive spamming can DoS the SillyTavern GUI, so there needs to be a rate limit.
                 #  - OTOH, we must constantly send something, or the GUI will lock up waiting.
                 TARGET_FPS = 25
                 frame_duration_target_sec = 1 / TARGET_FPS
                 if last_frame_send_complete_time is not None:
-                    time_now = time.time_ns()
+                    time_now = time.monotonic_ns()
                     this_frame_elapsed_sec = (time_now - last_frame_send_complete_time) / 10**9
                     # The 2* is a fudge factor. It doesn't matter if the frame is a bit too early, but we don't want it to be late.
                     time_until_frame_deadline = frame_duration_target_sec - this_frame_elapsed_sec - 2 * send_duration_sec
@@ -189,24 +210,29 @@ def result_feed() -> Response:
                     time_until_frame_deadline = 0.0  # nothing rendered yet
 
                 if time_until_frame_deadline <= 0.0:
-                    time_now = time.time_ns()
-                    yield (b"--frame\r\n"
-                           b"Content-Type: image/png\r\n\r\n" + image_bytes + b"\r\n")
-                    global_latest_frame_sent = id(image_bytes)  # atomic update, no need for lock
-                    send_duration_sec = (time.time_ns() - time_now) / 10**9  # about 0.12 ms on localhost (compress_level=1 or 6, doesn't matter)
+                    time_now = time.monotonic_ns()
+                    # Send the multipart header, the image, and the part terminator as separate chunks,
+                    # to avoid concatenating a fresh copy of the image data for each send.
+                    yield global_encoder_instance.frame_preamble
+                    yield image_bytes
+                    yield b"\r\n"
+                    global_encoder_instance.on_frame_sent(frame_seq)
+                    send_duration_sec = (time.monotonic_ns() - time_now) / 10**9  # about 0.12 ms on localhost (compress_level=1 or 6, doesn't matter)
                     # print(f"send {send_duration_sec:0.6g}s")  # DEBUG
 
                     # Update the FPS counter, measuring the time between network sends.
-                    time_now = time.time_ns()
+                    time_now = time.monotonic_ns()
                     if last_frame_send_complete_time is not None:
                         this_frame_elapsed_sec = (time_now - last_frame_send_complete_time) / 10**9
                         send_duration_statistics.add_datapoint(this_frame_elapsed_sec)
                     last_frame_send_complete_time = time_now
                 else:
+                    # Wait until the frame deadline. A newer frame doesn't need to wake us up early: the send rate limit applies to it too,
+                    # and we always send the latest frame available at the deadline.
                     time.sleep(time_until_frame_deadline)
 
                 # Log the FPS counter in 5-second intervals.
-                time_now = time.time_ns()
+                time_now = time.monotonic_ns()
                 if animation_running and (last_report_time is None or time_now - last_report_time > 5e9):
                     avg_send_sec = send_duration_statistics.average()
                     msec = round(1000 * avg_send_sec, 1)
@@ -215,8 +241,9 @@ def result_feed() -> Response:
                     logger.info(f"output: {msec:.1f}ms [{fps:.1f} FPS]; target {target_msec:.1f}ms [{TARGET_FPS:.1f} FPS]")
                     last_report_time = time_now
 
-            else:  # first frame not yet available
-                time.sleep(0.1)
+            else:  # first frame not yet available; block until the encoder publishes one
+                with _encoder_cond:
+                    _encoder_cond.wait_for(lambda: global_encoder_instance.latest_frame is not None, timeout=0.1)
 
     return Response(generate(), mimetype="multipart/x-mixed-replace; boundary=frame")
 
@@ -230,9 +257,8 @@ def talkinghead_load_file(stream) -> str:
     try:
         animation_running = False  # pause animation while loading a new image
         pil_image = PIL.Image.open(stream)  # Load the image using PIL.Image.open
-        img_data = io.BytesIO()  # Create a copy of the image data in memory using BytesIO
-        pil_image.save(img_data, format="PNG")
-        global_reload_image = PIL.Image.open(io.BytesIO(img_data.getvalue()))  # Set the global_reload_image to a copy of the image data
+        pil_image.load()  # Decode now, while the stream is still open
+        global_reload_image = pil_image.convert("RGBA") if pil_image.mode != "RGBA" else pil_image.copy()
     except PIL.Image.UnidentifiedImageError:
         logger.warning("Could not load input image from stream, loading blank")
         full_path = os.path.join(os.getcwd(), os.path.normpath(os.path.join(talkinghead_basedir, "tha3", "images", "inital.png")))
@@ -241,13 +267,14 @@ def talkinghead_load_file(stream) -> str:
         animation_running = True
     return "OK"
 
-def launch(device: str, model: str) -> Union[None, NoReturn]:
+def launch(device: str, model: str, image_format: str = "png") -> Union[None, NoReturn]:
     """Launch the talking head plugin (live mode).
 
     If the plugin fails to load, the process exits.
 
     device: "cpu" or "cuda"
     model: one of the folder names inside "talkinghead/tha3/models/"
+    image_format: "png", "webp" or "raw"; the format of the frames sent over the network
     """
     global global_animator_instance
     global global_encoder_instance
@@ -263,7 +290,7 @@ def launch(device: str, model: str) -> Union[None, NoReturn]:
 
         poser = load_poser(model, device, modelsdir=os.path.join(talkinghead_basedir, "tha3", "models"))
         global_animator_instance = Animator(poser, device)
-        global_encoder_instance = Encoder()
+        global_encoder_instance = Encoder(image_format)
 
         # Load initial blank character image
         full_path = os.path.join(os.getcwd(), os.path.normpath(os.path.join(talkinghead_basedir, "tha3", "images", "inital.png")))
@@ -280,14 +307,28 @@ def launch(device: str, model: str) -> Union[None, NoReturn]:
 # Internal stuff
 
 def convert_linear_to_srgb(image: torch.Tensor) -> torch.Tensor:
-    """RGBA (linear) -> RGBA (SRGB), preserving the alpha channel."""
-    rgb_image = torch_linear_to_srgb(image[0:3, :, :])
-    return torch.cat([rgb_image, image[3:4, :, :]], dim=0)
+    """RGBA (linear) -> RGBA (SRGB), preserving the alpha channel.
+
+    The conversion is done in-place; `image` is returned for convenience.
+    """
+    image[0:3, :, :].copy_(torch_linear_to_srgb(image[0:3, :, :]))
+    return image
 
 
 class Animator:
     """uWu Waifu"""
 
+    # Morphs animated by the sway driver.
+    SWAYPARTS = ["head_x_index", "head_y_index", "neck_z_index", "body_y_index", "body_z_index"]
+
+    # Slots in the per-frame random number buffer, `self._rng_buf`.
+    _RNG_BLINK = 0  # whether to blink
+    _RNG_BLINK_INTERVAL = 1
+    _RNG_TALK = 2
+    _RNG_SWAY_INTERVAL = 3
+    _RNG_MACROSWAY = slice(4, 4 + len(SWAYPARTS))
+    _RNG_MICROSWAY = slice(4 + len(SWAYPARTS), 4 + 2 * len(SWAYPARTS))
+
     def __init__(self, poser: Poser, device: torch.device):
         self.poser = poser
         self.device = device
@@ -295,16 +336,57 @@ class Animator:
         self.reset_animation_state()
 
         self.postprocessor = Postprocessor(device)
+
+        # The poser input pose, as a batch of one, [1, num_morphs]. Preallocated, so that each frame only copies the new values in.
+        # On CUDA, the upload goes through a pinned host buffer, so that it can be asynchronous. On CPU, we write directly into the pose tensor.
+        self._pose_tensor = torch.empty(1, len(posedict_keys), device=device, dtype=poser.get_dtype())
+        if torch.device(device).type == "cuda":
+            self._pose_host = torch.empty(1, len(posedict_keys), dtype=poser.get_dtype(), pin_memory=True)
+        else:
+            self._pose_host = None
+
         self.render_duration_statistics = RunningAverage()
         self.animator_thread = None
 
         self.source_image: Optional[torch.tensor] = None
         self.result_image: Optional[np.array] = None
-        self.new_frame_available = False
+        self.frame_id = 0  # incremented each time a new frame is published in `result_image`
+        self.frame_produced = threading.Event()  # animator -> encoder: a new frame is available in `result_image`
+        self.frame_consumed = threading.Event()  # encoder -> animator: the encoder has taken the latest frame
+        self.frame_consumed.set()  # nothing rendered yet, so there is nothing to wait for
         self.last_report_time = None
 
         self.emotions, self.emotion_names = load_emotion_presets(os.path.join("talkinghead", "emotions"))
 
+        # Morph indices used by the animation drivers. These are constant, so look them up only once.
+        self._idx_eye_l = posedict_key_to_index["eye_wink_left_index"]
+        self._idx_eye_r = posedict_key_to_index["eye_wink_right_index"]
+        self._idx_mouth = posedict_key_to_index["mouth_aaa_index"]
+        self._idx_breath = posedict_key_to_index["breathing_index"]
+        self._sway_idx = np.array([posedict_key_to_index[key] for key in self.SWAYPARTS], dtype=np.int32)
+
+        # Dense form of the emotion presets, one row per emotion, for the animation drivers.
+        # The emotion mask is True where the emotion overrides the morph. Breathing is never overridden.
+        self.emotion_index = {emotion_name: row for row, emotion_name in enumerate(self.emotion_names)}
+        self.emotion_matrix, self.emotion_mask = posedicts_to_pose_matrix([self.emotions[emotion_name] for emotion_name in self.emotion_names])
+        self.emotion_mask[:, self._idx_breath] = False
+        self._emotion_idx_confusion = self.emotion_index["confusion"]  # special-cased by the blinking driver
+
+        # The pose is a `np.float32` array of morph values, in the order of `posedict_keys`. The animation drivers
+        # operate on it with vectorized NumPy operations instead of looping over the morphs in Python.
+        #
+        # The drivers update their arguments in-place, so we keep preallocated scratch buffers for the intermediate results.
+        self._target_pose = np.empty(len(posedict_keys), dtype=np.float32)
+        self._pose_delta = np.empty(len(posedict_keys), dtype=np.float32)
+
+        # All random numbers the animation drivers need for one frame are generated with a single call at the start
+        # of the frame, uniformly in [0, 1). Each driver then scales the values in its own slots to the range it needs.
+        self._rng = np.random.default_rng()
+        self._rng_buf = np.empty(32, dtype=np.float32)
+
+        # Breathing curve over one cycle, as a lookup table: 0 ... 1 ... 0, smoothly, with slow start and end, fast middle.
+        self._breath_lut = np.sin(np.linspace(0.0, np.pi, 1024, endpoint=False, dtype=np.float32))**2
+
     # --------------------------------------------------------------------------------
     # Management
 
@@ -312,13 +394,14 @@ class Animator:
         """Start the animation thread."""
         self._terminated = False
         def animator_update():
-            while not self._terminated:
-                try:
-                    self.render_animation_frame()
-                except Exception as exc:
-                    logger.error(exc)
-                    raise  # let the animator stop so we won't spam the log
-                time.sleep(0.01)  # rate-limit the renderer to 100 FPS maximum (this could be adjusted later)
+            # We never train here, so switch off autograd tracking for the whole lifetime of the animator thread.
+            with torch.inference_mode():
+                while not self._terminated:
+                    try:
+                        self.render_animation_frame()
+                    except Exception as exc:
+                        logger.error(exc)
+                        raise  # let the animator stop so we won't spam the log
         self.animator_thread = threading.Thread(target=animator_update, daemon=True)
         self.animator_thread.start()
         atexit.register(self.exit)
@@ -338,15 +421,17 @@ class Animator:
 
         self.last_emotion = None
         self.last_emotion_change_timestamp = None
+        self._emotion_idx = None
+        self._emotion_changed = False
 
         self.last_blink_timestamp = None
-        self.blink_interval = None
+        self.blink_interval_ns = None
 
         self.last_sway_target_timestamp = None
         self.last_sway_target_pose = None
-        self.sway_interval = None
+        self.sway_interval_ns = None
 
-        self.breathing_epoch = time.time_ns()
+        self.breathing_epoch = time.monotonic_ns()
 
     def load_image(self, file_path=None) -> None:
         """Load the image file at `file_path`, and replace the current character with it.
@@ -378,8 +463,11 @@ class Animator:
                 logger.error("load_image: image must have alpha channel")
                 self.source_image = None
             else:
+                # Store the image as a batch of one, [1, c, h, w], which is the layout the poser works in.
+                # The poser then receives the same tensor object every frame, so its input cache can detect
+                # an unchanged source image by identity, without comparing the image contents each frame.
                 self.source_image = extract_pytorch_image_from_PIL_image(pil_image) \
-                    .to(self.device).to(self.poser.get_dtype())
+                    .to(self.device).to(self.poser.get_dtype()).unsqueeze(0).contiguous()
 
         except Exception as exc:
             logger.error(f"load_image: {exc}")
@@ -390,80 +478,69 @@ class Animator:
     # --------------------------------------------------------------------------------
     # Animation drivers
 
-    def apply_emotion_to_pose(self, emotion_posedict: Dict[str, float], pose: List[float]) -> List[float]:
-        """Copy all morphs except breathing from `emotion_posedict` to `pose`.
+    def apply_emotion_to_pose(self, emotion_idx: int, pose: np.array, target_pose: np.array) -> None:
+        """Copy all morphs except breathing from the emotion preset at row `emotion_idx` of `self.emotion_matrix` to `target_pose`.
 
-        If a morph does not exist in `emotion_posedict`, its value is copied from the original `pose`.
+        If a morph does not exist in the emotion preset, its value is copied from `pose`.
 
-        Return the modified pose.
+        `pose` is not modified.
         """
-        new_pose = list(pose)  # copy
-        for idx, key in enumerate(posedict_keys):
-            if key in emotion_posedict and key != "breathing_index":
-                new_pose[idx] = emotion_posedict[key]
-        return new_pose
+        np.copyto(target_pose, pose)
+        np.copyto(target_pose, self.emotion_matrix[emotion_idx], where=self.emotion_mask[emotion_idx])
 
-    def animate_blinking(self, pose: List[float]) -> List[float]:
+    def animate_blinking(self, pose: np.array, time_now: int) -> None:
         """Eye blinking animation driver.
 
-        Return the modified pose.
+        `time_now`: timestamp of the current frame, from `time.monotonic_ns()`.
+
+        Modifies `pose` in-place.
         """
-        should_blink = (random.random() <= 0.03)
+        should_blink = (self._rng_buf[self._RNG_BLINK] <= 0.03)
 
         # Prevent blinking too fast in succession.
-        time_now = time.time_ns()
-        if self.blink_interval is not None:
+        if self.blink_interval_ns is not None:
             # ...except when the "confusion" emotion has been entered recently.
-            seconds_since_last_emotion_change = (time_now - self.last_emotion_change_timestamp) / 10**9
-            if current_emotion == "confusion" and seconds_since_last_emotion_change < 10.0:
+            if self._emotion_idx == self._emotion_idx_confusion and time_now - self.last_emotion_change_timestamp < 10 * 10**9:
                 pass
             else:
-                seconds_since_last_blink = (time_now - self.last_blink_timestamp) / 10**9
-                if seconds_since_last_blink < self.blink_interval:
+                if time_now - self.last_blink_timestamp < self.blink_interval_ns:
                     should_blink = False
 
         if not should_blink:
-            return pose
+            return
 
         # If there should be a blink, set the wink morphs to 1.
-        new_pose = list(pose)  # copy
-        for morph_name in ["eye_wink_left_index", "eye_wink_right_index"]:
-            idx = posedict_key_to_index[morph_name]
-            new_pose[idx] = 1.0
+        pose[self._idx_eye_l] = 1.0
+        pose[self._idx_eye_r] = 1.0
 
         # Typical for humans is 12...20 times per minute, i.e. 5...3 seconds interval.
         self.last_blink_timestamp = time_now
-        self.blink_interval = random.uniform(2.0, 5.0)  # seconds; duration of this blink before the next one can begin
-
-        return new_pose
+        self.blink_interval_ns = int((2.0 + 3.0 * float(self._rng_buf[self._RNG_BLINK_INTERVAL])) * 10**9)  # [2, 5) seconds; duration of this blink before the next one can begin
 
-    def animate_talking(self, pose: List[float]) -> List[float]:
+    def animate_talking(self, pose: np.array) -> None:
         """Talking animation driver.
 
         Works by randomizing the mouth-open state.
 
-        Return the modified pose.
+        Modifies `pose` in-place.
         """
         if not is_talking:
-            return pose
+            return
 
         # TODO: improve talking animation once we get the client to actually use it
-        new_pose = list(pose)  # copy
-        idx = posedict_key_to_index["mouth_aaa_index"]
-        x = pose[idx]
-        x = abs(1.0 - x) + random.uniform(-2.0, 2.0)
+        idx = self._idx_mouth
+        x = float(pose[idx])
+        x = abs(1.0 - x) + (4.0 * float(self._rng_buf[self._RNG_TALK]) - 2.0)  # random in [-2, 2)
         x = max(0.0, min(x, 1.0))  # clamp (not the manga studio)
-        new_pose[idx] = x
-        return new_pose
+        pose[idx] = x
 
-    def compute_sway_target_pose(self, original_target_pose: List[float]) -> List[float]:
+    def compute_sway_target_pose(self, target_pose: np.array, time_now: int) -> None:
         """History-free sway animation driver.
 
-        original_target_pose: emotion pose to modify with a randomized sway target
+        target_pose: emotion pose to modify with a randomized sway target. Modified in-place.
+        time_now: timestamp of the current frame, from `time.monotonic_ns()`.
 
         The target is randomized again when necessary; this takes care of caching internally.
-
-        Return the modified pose.
         """
         # We just modify the target pose, and let the integrator (`interpolate_pose`) do the actual animation.
         # - This way we don't need to track start state, progress, etc.
@@ -474,15 +551,13 @@ class Animator:
         random_max = 0.6  # max sway magnitude from center position of each morph
         noise_max = 0.02  # amount of dynamic noise (re-generated every frame), added on top of the sway target
 
-        SWAYPARTS = ["head_x_index", "head_y_index", "neck_z_index", "body_y_index", "body_z_index"]
+        sway_idx = self._sway_idx
 
-        def macrosway() -> List[float]:  # this handles caching and everything
-            time_now = time.time_ns()
+        def macrosway() -> np.array:  # this handles caching and everything
             should_pick_new_sway_target = True
-            if current_emotion == self.last_emotion:
-                if self.sway_interval is not None:  # have we created a swayed pose at least once?
-                    seconds_since_last_sway_target = (time_now - self.last_sway_target_timestamp) / 10**9
-                    if seconds_since_last_sway_target < self.sway_interval:
+            if not self._emotion_changed:
+                if self.sway_interval_ns is not None:  # have we created a swayed pose at least once?
+                    if time_now - self.last_sway_target_timestamp < self.sway_interval_ns:
                         should_pick_new_sway_target = False
             # else, emotion has changed, invalidating the old sway target, because it is based on the old emotion.
 
@@ -490,61 +565,61 @@ class Animator:
                 if self.last_sway_target_pose is not None:  # When keeping the same sway target, return the cached sway pose if we have one.
                     return self.last_sway_target_pose
                 else:  # Should not happen, but let's be robust.
-                    return original_target_pose
+                    return target_pose
 
-            new_target_pose = list(original_target_pose)  # copy
-            for key in SWAYPARTS:
-                idx = posedict_key_to_index[key]
-                target_value = original_target_pose[idx]
+            if self.last_sway_target_pose is None:
+                self.last_sway_target_pose = np.empty_like(target_pose)
+            new_target_pose = self.last_sway_target_pose
+            np.copyto(new_target_pose, target_pose)
+            target_values = target_pose[sway_idx]
 
-                # Determine the random range so that the swayed target always stays within `[-random_max, random_max]`, regardless of `target_value`.
-                # TODO: This is a simple zeroth-order solution that just cuts the random range.
-                #       Would be nicer to *gradually* decrease the available random range on the "outside" as the target value gets further from the origin.
-                random_upper = max(0, random_max - target_value)  # e.g. if target_value = 0.2, then random_upper = 0.4  => max possible = 0.6 = random_max
-                random_lower = min(0, -random_max - target_value)  # e.g. if target_value = -0.2, then random_lower = -0.4  => min possible = -0.6 = -random_max
-                random_value = random.uniform(random_lower, random_upper)
+            # Determine the random range so that the swayed target always stays within `[-random_max, random_max]`, regardless of `target_value`.
+            # TODO: This is a simple zeroth-order solution that just cuts the random range.
+            #       Would be nicer to *gradually* decrease the available random range on the "outside" as the target value gets further from the origin.
+            random_upper = np.maximum(0.0, random_max - target_values)  # e.g. if target_value = 0.2, then random_upper = 0.4  => max possible = 0.6 = random_max
+            random_lower = np.minimum(0.0, -random_max - target_values)  # e.g. if target_value = -0.2, then random_lower = -0.4  => min possible = -0.6 = -random_max
+            random_values = random_lower + (random_upper - random_lower) * self._rng_buf[self._RNG_MACROSWAY]
 
-                new_target_pose[idx] = target_value + random_value
+            new_target_pose[sway_idx] = target_values + random_values
 
-            self.last_sway_target_pose = new_target_pose
             self.last_sway_target_timestamp = time_now
-            self.sway_interval = random.uniform(5.0, 10.0)  # seconds; duration of this sway target before randomizing new one
+            self.sway_interval_ns = int((5.0 + 5.0 * float(self._rng_buf[self._RNG_SWAY_INTERVAL])) * 10**9)  # [5, 10) seconds; duration of this sway target before randomizing new one
             return new_target_pose
 
         # Add dynamic noise (re-generated every frame) to the target to make the animation look less robotic, especially once we are near the target pose.
         def add_microsway() -> None:  # DANGER: MUTATING FUNCTION
-            for key in SWAYPARTS:
-                idx = posedict_key_to_index[key]
-                x = new_target_pose[idx] + random.uniform(-noise_max, noise_max)
-                x = max(-1.0, min(x, 1.0))
-                new_target_pose[idx] = x
+            x = new_target_pose[sway_idx] + noise_max * (2.0 * self._rng_buf[self._RNG_MICROSWAY] - 1.0)
+            new_target_pose[sway_idx] = np.clip(x, -1.0, 1.0)
 
         new_target_pose = macrosway()
         add_microsway()
-        return new_target_pose
+        if new_target_pose is not target_pose:
+            np.copyto(target_pose, new_target_pose)
 
-    def animate_breathing(self, pose: List[float]) -> List[float]:
+    def animate_breathing(self, pose: np.array, time_now: int) -> None:
         """Breathing animation driver.
 
-        Return the modified pose.
+        `time_now`: timestamp of the current frame, from `time.monotonic_ns()`.
+
+        Modifies `pose` in-place.
         """
-        breathing_cycle_duration = 4.0  # seconds
+        breathing_cycle_duration_ns = 4 * 10**9
 
-        time_now = time.time_ns()
-        t = (time_now - self.breathing_epoch) / 10**9  # seconds since breathing-epoch
-        cycle_pos = t / breathing_cycle_duration  # number of cycles since breathing-epoch
-        if cycle_pos > 1.0:  # prevent loss of accuracy in long sessions
-            self.breathing_epoch = time_now  # TODO: be more accurate here, should sync to a whole cycle
-        cycle_pos = cycle_pos - float(int(cycle_pos))  # fractional part
+        # Keep the epoch within one cycle of the current time, to keep the numbers small in long sessions.
+        # We advance the epoch by whole cycles, so the breathing phase stays continuous.
+        t = time_now - self.breathing_epoch  # nanoseconds since breathing-epoch
+        if t >= breathing_cycle_duration_ns:
+            self.breathing_epoch += (t // breathing_cycle_duration_ns) * breathing_cycle_duration_ns
+        phase = t % breathing_cycle_duration_ns  # position within the current cycle
 
-        new_pose = list(pose)  # copy
-        idx = posedict_key_to_index["breathing_index"]
-        new_pose[idx] = math.sin(cycle_pos * math.pi)**2  # 0 ... 1 ... 0, smoothly, with slow start and end, fast middle
-        return new_pose
+        lut = self._breath_lut
+        pose[self._idx_breath] = lut[(phase * len(lut)) // breathing_cycle_duration_ns]
 
-    def interpolate_pose(self, pose: List[float], target_pose: List[float], step: float = 0.1) -> List[float]:
+    def interpolate_pose(self, pose: np.array, target_pose: np.array, step: float = 0.1) -> None:
         """Rate-based pose integrator. Interpolate from `pose` toward `target_pose`.
 
+        Modifies `pose` in-place.
+
         `step`: [0, 1]; how far toward `target_pose` to interpolate. 0 is fully `pose`, 1 is fully `target_pose`.
 
         Note that looping back the output as `pose`, while keeping `target_pose` constant, causes the current pose
@@ -559,18 +634,13 @@ class Animator:
         """
         # NOTE: This overwrites blinking, talking, and breathing, but that doesn't matter, because we apply this first.
         # The other animation drivers then modify our result.
-        new_pose = list(pose)  # copy
-        for idx, key in enumerate(posedict_keys):
-            # # We now animate blinking *after* interpolating the pose, so when blinking, the eyes close instantly.
-            # # This modification would make the blink also end instantly.
-            # if key in ["eye_wink_left_index", "eye_wink_right_index"]:
-            #     new_pose[idx] = target_pose[idx]
-            # else:
-            #     ...
-
-            delta = target_pose[idx] - pose[idx]
-            new_pose[idx] = pose[idx] + step * delta
-        return new_pose
+        #
+        # We now animate blinking *after* interpolating the pose, so when blinking, the eyes close instantly.
+        # To make the blink also end instantly, we could copy the wink morphs directly from `target_pose` here.
+        delta = self._pose_delta
+        np.subtract(target_pose, pose, out=delta)
+        delta *= step
+        pose += delta
 
     # --------------------------------------------------------------------------------
     # Animation logic
@@ -578,73 +648,98 @@ class Animator:
     def render_animation_frame(self) -> None:
         """Render an animation frame.
 
-        If the previous rendered frame has not been retrieved yet, do nothing.
+        If the previous rendered frame has not been retrieved yet, wait (with a timeout) until it is.
+        If it still hasn't been retrieved, do nothing.
+
+        This is called by the animator thread, which runs in `torch.inference_mode`.
         """
+        idle_sec = 0.1  # how long to wait at a time when there's nothing to render
+
         if not animation_running:
+            time.sleep(idle_sec)
             return
 
         # If no one has retrieved the latest rendered frame yet, do not render a new one.
-        if self.new_frame_available:
+        # This also rate-limits the renderer to the speed at which the frames are consumed.
+        if not self.frame_consumed.wait(timeout=idle_sec):
             return
 
         if global_reload_image is not None:
             self.load_image()
         if self.source_image is None:
+            time.sleep(idle_sec)
             return
 
-        time_render_start = time.time_ns()
+        time_render_start = time.monotonic_ns()  # also serves as the timestamp of this frame for the animation drivers
 
-        if self.current_pose is None:  # initialize character pose at plugin startup
-            self.current_pose = posedict_to_pose(self.emotions[current_emotion])
+        self._rng.random(dtype=np.float32, out=self._rng_buf)  # random numbers for this frame's animation drivers
 
-        emotion_posedict = self.emotions[current_emotion]
-        if current_emotion != self.last_emotion:  # some animation drivers need to know when the emotion last changed
+        # Pick up the emotion set by the API once per frame. The animation drivers then use only the cached
+        # `_emotion_idx` and `_emotion_changed`, without touching the global or the emotion dictionaries.
+        emotion = current_emotion
+        self._emotion_changed = (emotion != self.last_emotion)
+        if self._emotion_changed:  # some animation drivers need to know when the emotion last changed
+            self._emotion_idx = self.emotion_index[emotion]
             self.last_emotion_change_timestamp = time_render_start
 
-        target_pose = self.apply_emotion_to_pose(emotion_posedict, self.current_pose)
-        target_pose = self.compute_sway_target_pose(target_pose)
-
-        self.current_pose = self.interpolate_pose(self.current_pose, target_pose)
-        self.current_pose = self.animate_blinking(self.current_pose)
-        self.current_pose = self.animate_talking(self.current_pose)
-        self.current_pose = self.animate_breathing(self.current_pose)
-
-        # Update this last so that animation drivers have access to the old emotion, too.
-        self.last_emotion = current_emotion
-
-        pose = torch.tensor(self.current_pose, device=self.device, dtype=self.poser.get_dtype())
-
-        with torch.no_grad():
-            # - [0]: model's output index for the full result image
-            # - model's data range is [-1, +1], linear intensity ("gamma encoded")
-            output_image = self.poser.pose(self.source_image, pose)[0].float()
-            # output_image = (output_image + 1.0) / 2.0  # -> [0, 1]
-            output_image.add_(1.0)
-            output_image.mul_(0.5)
+        if self.current_pose is None:  # initialize character pose at plugin startup
+            self.current_pose = self.emotion_matrix[self._emotion_idx].copy()
 
-            self.postprocessor.render_into(output_image)  # apply pixel-space glitch artistry
-            output_image = convert_linear_to_srgb(output_image)  # apply gamma correction
+        target_pose = self._target_pose
+        self.apply_emotion_to_pose(self._emotion_idx, self.current_pose, target_pose)
+        self.compute_sway_target_pose(target_pose, time_render_start)
 
-            # convert [c, h, w] float -> [h, w, c] uint8
-            c, h, w = output_image.shape
-            output_image = torch.transpose(output_image.reshape(c, h * w), 0, 1).reshape(h, w, c)
-            output_image = (255.0 * output_image).byte()
+        self.interpolate_pose(self.current_pose, target_pose)
+        self.animate_blinking(self.current_pose, time_render_start)
+        self.animate_talking(self.current_pose)
+        self.animate_breathing(self.current_pose, time_render_start)
 
-            output_image_numpy = output_image.detach().cpu().numpy()
+        # Update this last so that animation drivers have access to the old emotion, too.
+        self.last_emotion = emotion
+
+        if self._pose_host is None:
+            self._pose_tensor[0].copy_(torch.from_numpy(self.current_pose))
+        else:
+            # The previous upload from `_pose_host` has completed by now, since the previous frame's download was synchronous.
+            self._pose_host[0].copy_(torch.from_numpy(self.current_pose))
+            self._pose_tensor.copy_(self._pose_host, non_blocking=True)
+
+        # - [0]: model's output index for the full result image
+        # - model's data range is [-1, +1], linear intensity ("gamma encoded")
+        output_image = self.poser.pose(self.source_image, self._pose_tensor)[0].float()
+
+        output_image = self.postprocess_frame(output_image)
+        if output_image.is_cuda:
+            # Copy to pinned memory for a faster transfer. Torch's caching host allocator recycles the pinned
+            # buffer once we drop our last reference to it, so this doesn't allocate fresh pinned memory each frame.
+            # We can't simply overwrite one persistent buffer, since the encoder may still be reading the previous frame.
+            host_image = torch.empty(output_image.shape, dtype=torch.uint8, pin_memory=True)
+            host_image.copy_(output_image, non_blocking=True)
+            torch.cuda.current_stream(output_image.device).synchronize()  # wait for the copy before handing the data to NumPy
+            output_image_numpy = host_image.numpy()
+        else:
+            output_image_numpy = output_image.numpy()
 
         # Update FPS counter, measuring animation frame render time only.
         #
         # This says how fast the renderer *can* run on the current hardware;
         # note we don't actually render more frames than the client consumes.
-        time_now = time.time_ns()
+        time_now = time.monotonic_ns()
         if self.source_image is not None:
             render_elapsed_sec = (time_now - time_render_start) / 10**9
             self.render_duration_statistics.add_datapoint(render_elapsed_sec)
 
         # Set the new rendered frame as the output image, and mark the frame as ready for consumption.
-        with _animator_output_lock:
-            self.result_image = output_image_numpy  # atomic replace
-            self.new_frame_available = True
+        #
+        # This needs no lock, because each step is atomic, and the order of the steps is what matters:
+        #  - `frame_consumed` is cleared first, so the encoder's `set` for this frame (which it can only do after seeing
+        #    the new `frame_id`) is never lost.
+        #  - `frame_id` is updated after `result_image`, so when the encoder sees the new `frame_id`, it also gets the new image.
+        #  - The encoder's reference to the previous `result_image` keeps that buffer alive while it encodes.
+        self.frame_consumed.clear()
+        self.result_image = output_image_numpy  # atomic replace
+        self.frame_id += 1
+        self.frame_produced.set()
 
         # Log the FPS counter in 5-second intervals.
         if animation_running and (self.last_report_time is None or time_now - self.last_report_time > 5e9):
@@ -654,85 +749,208 @@ class Animator:
             logger.info(f"render: {msec:.1f}ms [{fps} FPS available]")
             self.last_report_time = time_now
 
+    def postprocess_frame(self, output_image: torch.Tensor) -> torch.Tensor:
+        """Postprocess and gamma-correct a rendered frame for encoding.
+
+        `output_image`: [c, h, w] float, data range [-1, +1], linear intensity. Overwritten.
+
+        Return the result as a [h, w, c] uint8 tensor, on the same device.
+        """
+        # output_image = (output_image + 1.0) / 2.0  # -> [0, 1]
+        output_image.add_(1.0)
+        output_image.mul_(0.5)
+
+        self.postprocessor.render_into(output_image)  # apply pixel-space glitch artistry
+        convert_linear_to_srgb(output_image)  # apply gamma correction
+
+        # convert [c, h, w] float -> [h, w, c] uint8
+        output_image = output_image.permute(1, 2, 0).contiguous()
+        output_image.mul_(255.0).clamp_(0.0, 255.0)
+        return output_image.to(torch.uint8)
+
 
 class Encoder:
     """Network transport encoder.
 
-    We read each frame from the animator as it becomes ready, and keep it available in `self.image_bytes`
-    until the next frame arrives. The `self.image_bytes` buffer is replaced atomically, so this needs no lock
-    (you always get the latest available frame at the time you access `image_bytes`).
+    We read each frame from the animator as it becomes ready, and keep it available in `self.latest_frame`
+    until the next frame arrives. This is a tuple `(frame_seq, image_bytes)`, where `frame_seq` is a new sequence
+    number for each published frame, so that the network send can tell the encoder which frame it has sent
+    (see `on_frame_sent`).
+
+    The `self.latest_frame` tuple is replaced atomically, so this needs no lock (you always get the latest
+    available frame, together with its own sequence number, at the time you access `latest_frame`).
     """
 
-    def __init__(self) -> None:
-        self.image_bytes = None
+    # Supported output formats, and their MIME types.
+    mimetypes = {"png": b"image/png",
+                 "webp": b"image/webp",
+                 "raw": b"application/octet-stream"}  # header `struct.pack("<HHI", h, w, len(payload))`, then RGBA payload
+
+    def __init__(self, image_format: str = "png") -> None:
+        if image_format not in self.mimetypes:
+            raise RuntimeError(f"Encoder: unsupported image format '{image_format}'; supported: {list(self.mimetypes.keys())}")
+        self.image_format = image_format
+        self.mimetype = self.mimetypes[image_format]
+        self.frame_preamble = b"--frame\r\nContent-Type: " + self.mimetype + b"\r\n\r\n"  # multipart header for each frame in `result_feed`
+        self.latest_frame: Optional[Tuple[int, bytes]] = None  # (frame_seq, image_bytes)
+        self.frame_seq = 0  # sequence number of the frame currently in `latest_frame`; 0 = no frame yet
+        self.latest_frame_sent = 0  # `frame_seq` of the latest frame that has been sent over the network at least once
+        self._frame_sent_lock = threading.Lock()  # protect `latest_frame_sent` from concurrent updates by multiple network clients
+        self._frame_sent_event = threading.Event()  # network send -> encoder: a frame has been sent
+        self._shape = None  # frame shape the encoder is currently configured for; see `configure`
         self.encoder_thread = None
 
+    def configure(self, h: int, w: int, channels: int) -> None:
+        """Prepare the encoder for frames of shape `[h, w, channels]`.
+
+        Called automatically by the encoder thread whenever the frame shape changes (in practice, at the first frame).
+        """
+        self._shape = (h, w, channels)
+        self._mode = "RGBA" if channels == 4 else "RGB"
+        self._size = (w, h)
+        # Scratch buffer for the Pillow encoders, reused for every frame. Preallocated to the size of an uncompressed frame
+        # (plus some headroom for the headers), so that it never needs to grow while encoding.
+        self._buffer = io.BytesIO(bytes(h * w * channels + 1024))
+
+        # Pick the encode function once, so the per-frame path has no format or backend branches.
+        #
+        # For PNG, use the fastest compression level available.
+        #
+        # On an i7-12700H @ 2.3 GHz (laptop optimized for low fan noise), with Pillow:
+        #  - `compress_level=1` (fastest), about 20 ms
+        #  - `compress_level=6` (default), about 40 ms (!) - too slow!
+        #  - `compress_level=9` (smallest size), about 120 ms
+        #
+        # If `pyspng` (libspng) is installed, we use it for PNG. It is several times faster than Pillow
+        # at the same compression level, and encodes directly from the NumPy array. The next best option
+        # is `imagecodecs`, which also encodes directly from the array.
+        #
+        # WebP (lossy, with alpha) at the fastest `method=0` is both faster to encode and smaller.
+        if self.image_format == "raw":
+            self._encode = self._encode_raw
+        elif self.image_format == "png" and pyspng is not None:
+            self._encode = self._encode_pyspng
+        elif self.image_format == "png" and imagecodecs is not None:
+            self._encode = self._encode_imagecodecs
+        else:
+            if self.image_format == "webp":
+                self._pillow_save_kwargs = {"format": "WEBP", "quality": 90, "method": 0}
+            else:
+                self._pillow_save_kwargs = {"format": "PNG", "compress_level": 1}
+            self._encode = self._encode_pillow
+
+    def _encode_raw(self, image_array: np.array) -> bytes:
+        """Encode a frame in the raw format. No compression; for localhost/LAN custom clients."""
+        # Join the header and a zero-copy view of the pixel data, so the frame is copied only once.
+        h, w = self._shape[:2]
+        header = struct.pack("<HHI", h, w, image_array.nbytes)
+        return b"".join((header, memoryview(image_array).cast("B")))
+
+    def _encode_pyspng(self, image_array: np.array) -> bytes:
+        """Encode a frame as PNG, using `pyspng`."""
+        return pyspng.encode(image_array, compress_level=1)
+
+    def _encode_imagecodecs(self, image_array: np.array) -> bytes:
+        """Encode a frame as PNG, using `imagecodecs`."""
+        return imagecodecs.png_encode(image_array, level=1)
+
+    def _encode_pillow(self, image_array: np.array) -> bytes:
+        """Encode a frame as PNG or WebP, using Pillow."""
+        # Wrap the frame as a PIL image without copying.
+        pil_image = PIL.Image.frombuffer(self._mode, self._size, image_array, "raw", self._mode, 0, 1)
+
+        # Overwrite the scratch buffer from the start. We don't truncate it, because that would free its memory;
+        # instead, we copy out only the part that was written for this frame.
+        buffer = self._buffer
+        buffer.seek(0)
+        pil_image.save(buffer, **self._pillow_save_kwargs)
+        with buffer.getbuffer() as view:
+            return bytes(view[:buffer.tell()])
+
+    def on_frame_sent(self, frame_seq: int) -> None:
+        """Report that the frame with sequence number `frame_seq` has been sent over the network.
+
+        Called by the network send. Safe to call from multiple threads (one per client).
+        """
+        # Fast path: the network send re-sends the same frame whenever the encoder hasn't published a new one yet.
+        # Such a frame has already been recorded, so there is nothing to update, and nobody to wake up.
+        # Reading the int is atomic, so this check needs no lock.
+        if frame_seq <= self.latest_frame_sent:
+            return
+        # The web server runs each client in its own thread. Never let a slow client roll the sent frame back.
+        with self._frame_sent_lock:
+            if frame_seq > self.latest_frame_sent:
+                self.latest_frame_sent = frame_seq
+        self._frame_sent_event.set()
+
     def start(self) -> None:
         """Start the output encoder thread."""
         self._terminated = False
         def encoder_update():
+            monotonic_ns = time.monotonic_ns  # bound once, since we take a few timestamps per frame
+            last_seen_frame_id = 0
             last_report_time = None
             encode_duration_statistics = RunningAverage()
             wait_duration_statistics = RunningAverage()
 
             while not self._terminated:
+                # Wait until the animator has a new frame for us. This also rate-limits the encoder to the render speed.
+                global_animator_instance.frame_produced.wait(timeout=0.1)
+
                 # Retrieve a new frame from the animator if available.
+                #
+                # Clear the event before checking `frame_id`, so that a frame published right after the check still wakes us up.
+                # Read `frame_id` before `result_image` (the animator writes them in the opposite order).
                 have_new_frame = False
-                time_encode_start = time.time_ns()
-                with _animator_output_lock:
-                    if global_animator_instance.new_frame_available:
-                        image_rgba = global_animator_instance.result_image
-                        global_animator_instance.new_frame_available = False  # animation frame consumed; start rendering the next one
-                        have_new_frame = True  # This flag is needed so we can release the animator lock as early as possible.
+                global_animator_instance.frame_produced.clear()
+                frame_id = global_animator_instance.frame_id
+                if frame_id != last_seen_frame_id:
+                    image_rgba = global_animator_instance.result_image
+                    last_seen_frame_id = frame_id
+                    global_animator_instance.frame_consumed.set()  # animation frame consumed; start rendering the next one
+                    have_new_frame = True
 
                 # If a new frame arrived, pack it for sending (only once for each new frame).
+                # We take at most three timestamps per frame, and reuse them for the FPS counters and the log throttle.
                 if have_new_frame:
+                    time_encode_start = monotonic_ns()
                     try:
-                        pil_image = PIL.Image.fromarray(np.uint8(image_rgba[:, :, :3]))
-                        if image_rgba.shape[2] == 4:
-                            alpha_channel = image_rgba[:, :, 3]
-                            pil_image.putalpha(PIL.Image.fromarray(np.uint8(alpha_channel)))
-
-                        # Save as PNG with RGBA mode. Use the fastest compression level available.
-                        #
-                        # On an i7-12700H @ 2.3 GHz (laptop optimized for low fan noise):
-                        #  - `compress_level=1` (fastest), about 20 ms
-                        #  - `compress_level=6` (default), about 40 ms (!) - too slow!
-                        #  - `compress_level=9` (smallest size), about 120 ms
-                        #
-                        # time_now = time.time_ns()
-                        buffer = io.BytesIO()
-                        pil_image.save(buffer, format="PNG", compress_level=1)
-                        image_bytes = buffer.getvalue()
-                        # pack_duration_sec = (time.time_ns() - time_now) / 10**9
+                        # All encoders read the frame as one interleaved, C-contiguous uint8 buffer, [h, w, c].
+                        # The animator produces exactly that, so this is a no-op in practice (no copy).
+                        assert image_rgba.dtype == np.uint8, f"expected a uint8 frame from the animator, got {image_rgba.dtype}"
+                        image_array = np.ascontiguousarray(image_rgba, dtype=np.uint8)
+                        if image_array.shape != self._shape:
+                            self.configure(*image_array.shape)
+                        image_bytes = self._encode(image_array)
+                        time_encode_end = monotonic_ns()
 
                         # We now have a new encoded frame; but first, sync with network send.
                         # This prevents from rendering/encoding more frames than are actually sent.
-                        previous_frame = self.image_bytes
-                        if previous_frame is not None:
-                            time_wait_start = time.time_ns()
-                            # Wait in 1ms increments until the previous encoded frame has been sent
-                            while global_latest_frame_sent != id(previous_frame) and not self._terminated:
-                                time.sleep(0.001)
-                            time_now = time.time_ns()
-                            wait_elapsed_sec = (time_now - time_wait_start) / 10**9
+                        if self.latest_frame is not None:
+                            # Wait until the previous encoded frame has been sent. The network send wakes us up via the event.
+                            # Clearing the event before re-checking ensures that we never miss a wakeup.
+                            while self.latest_frame_sent != self.frame_seq and not self._terminated:
+                                self._frame_sent_event.wait(timeout=0.05)
+                                self._frame_sent_event.clear()
+                            time_now = monotonic_ns()
                         else:
-                            wait_elapsed_sec = 0.0
+                            time_now = time_encode_end
 
-                        self.image_bytes = image_bytes  # atomic replace so no need for a lock
+                        self.frame_seq += 1
+                        self.latest_frame = (self.frame_seq, image_bytes)  # atomic replace so no need for a lock
+                        with _encoder_cond:
+                            _encoder_cond.notify_all()  # wake up any network sends still waiting for the first frame
                     except Exception as exc:
                         logger.error(exc)
                         raise  # let the encoder stop so we won't spam the log
 
                     # Update FPS counter.
-                    time_now = time.time_ns()
-                    walltime_elapsed_sec = (time_now - time_encode_start) / 10**9
-                    encode_elapsed_sec = walltime_elapsed_sec - wait_elapsed_sec
-                    encode_duration_statistics.add_datapoint(encode_elapsed_sec)
-                    wait_duration_statistics.add_datapoint(wait_elapsed_sec)
+                    encode_duration_statistics.add_datapoint((time_encode_end - time_encode_start) / 10**9)
+                    wait_duration_statistics.add_datapoint((time_now - time_encode_end) / 10**9)
+                else:
+                    time_now = monotonic_ns()
 
                 # Log the FPS counter in 5-second intervals.
-                time_now = time.time_ns()
                 if animation_running and (last_report_time is None or time_now - last_report_time > 5e9):
                     avg_encode_sec = encode_duration_statistics.average()
                     msec = round(1000 * avg_encode_sec, 1)
@@ -741,8 +959,6 @@ class Encoder:
                     fps = round(1 / avg_encode_sec, 1) if avg_encode_sec > 0.0 else 0.0
                     logger.info(f"encode: {msec:.1f}ms [{fps} FPS available]; send sync wait {wait_msec:.1f}ms")
                     last_report_time = time_now
-
-                time.sleep(0.01)  # rate-limit the encoder to 100 FPS maximum (this could be adjusted later)
         self.encoder_thread = threading.Thread(target=encoder_update, daemon=True)
         self.encoder_thread.start()
         atexit.register(self.exit)
@@ -80,6 +80,7 @@ class Postprocessor:
         self.chain = chain
         self._prev_h = None
         self._prev_w = None
+        self._vignetting_cache = (None, None)  # (strength, brightness)
 
     def render_into(self, image):
         """Apply current postprocess chain, modifying `image`."""
@@ -101,6 +102,9 @@ class Postprocessor:
             self._prev_h = h
             self._prev_w = w
 
+            # Static per-pixel effect profiles depend on the image size, so they must be recomputed.
+            self._vignetting_cache = (None, None)
+
         for filter_name, settings in self.chain:
             apply_filter = getattr(self, filter_name)
             apply_filter(image, **settings)
@@ -146,7 +150,7 @@ class Postprocessor:
         image.add_(brights)
 
         # We now have a fake HDR image. Tonemap it back to LDR.
-        image[:3, :, :] = 1.0 - torch.exp(-image[:3, :, :] * hdr_exposure)  # RGB: tonemap
+        image[:3, :, :].mul_(-hdr_exposure).exp_().neg_().add_(1.0)  # RGB: tonemap, 1 - exp(-x * hdr_exposure)
         image[3, :, :] = torch.maximum(image[3, :, :], brights[3, :, :])  # alpha: max-combine
         torch.clamp_(image, min=0.0, max=1.0)
 
@@ -212,10 +216,14 @@ class Postprocessor:
         from the center, scaled such that `d = 1.0` is reached at the corners.
         Thus, at the midpoints of the frame edges, `d = 1 / sqrt(2) ~ 0.707`.
         """
-        euclidean_distance_from_center = (self._meshy**2 + self._meshx**2)**0.5 / 2**0.5  # [h, w]
-        brightness = torch.cos(strength * euclidean_distance_from_center * math.pi)**2  # [h, w]
-        brightness = torch.unsqueeze(brightness, 0)  # -> [1, h, w]
-        image[:3, :, :] *= brightness
+        # The vignetting profile is static, so we only need to recompute it when the settings or the image size change.
+        cached_strength, brightness = self._vignetting_cache
+        if brightness is None or cached_strength != strength:
+            euclidean_distance_from_center = (self._meshy**2 + self._meshx**2)**0.5 / 2**0.5  # [h, w]
+            brightness = torch.cos(strength * euclidean_distance_from_center * math.pi)**2  # [h, w]
+            brightness = torch.unsqueeze(brightness, 0)  # -> [1, h, w]
+            self._vignetting_cache = (strength, brightness)
+        image[:3, :, :].mul_(brightness.to(image.dtype))
 
     # --------------------------------------------------------------------------------
     # Scifi hologram
@@ -359,7 +367,7 @@ class Postprocessor:
             glitch_height = int(min_glitch_height + (max_glitch_height - min_glitch_height) * glitch_height[0])
             noise_image = self._vhs_noise(image, height=glitch_height)
             # Apply glitch to RGB only, so fully transparent parts stay transparent (important to make the effect less distracting).
-            image[:3, line:(line + glitch_height), :] = (1.0 - strength) * image[:3, line:(line + glitch_height), :] + strength * noise_image
+            image[:3, line:(line + glitch_height), :].lerp_(noise_image, strength)
 
     def analog_vhstracking(self, image: torch.tensor, *,
                            base_offset: float = 0.03,
@@ -492,7 +500,7 @@ class Postprocessor:
         tinted_desat_image = Y * tint_color  # -> [c, h, w]
 
         # Final blend
-        image[:3, :, :] = (1.0 - strength_field) * image[:3, :, :] + strength_field * tinted_desat_image
+        image[:3, :, :].lerp_(tinted_desat_image, strength_field)
 
     def banding(self, image: torch.tensor, *,
                 strength: float = 0.4,
@@ -2,7 +2,7 @@
 
 __all__ = ["posedict_keys", "posedict_key_to_index",
            "load_emotion_presets",
-           "posedict_to_pose", "pose_to_posedict",
+           "posedict_to_pose", "pose_to_posedict", "posedicts_to_pose_matrix",
            "torch_image_to_numpy", "to_talkinghead_image",
            "RunningAverage"]
 
@@ -136,6 +136,25 @@ def pose_to_posedict(pose: List[float]) -> Dict[str, float]:
     """Convert `pose` into a posedict for saving into an emotion JSON."""
     return dict(zip(posedict_keys, pose))
 
+
+def posedicts_to_pose_matrix(posedicts: List[Dict[str, float]]) -> Tuple[np.array, np.array]:
+    """Convert a list of posedicts into a dense pose matrix, for fast vectorized access.
+
+    Returns the tuple `(pose_matrix, mask)`. Both are arrays of shape `[len(posedicts), len(posedict_keys)]`;
+    `pose_matrix` is `np.float32`, and `mask` is `bool`.
+
+    Row `j` of `pose_matrix` is `posedict_to_pose(posedicts[j])`. The `mask` is `True` where the posedict specifies
+    a value for the morph, and `False` where the morph is missing from the posedict.
+    """
+    pose_matrix = np.zeros((len(posedicts), len(posedict_keys)), dtype=np.float32)
+    mask = np.zeros((len(posedicts), len(posedict_keys)), dtype=bool)
+    for row, posedict in enumerate(posedicts):
+        pose_matrix[row, :] = posedict_to_pose(posedict)
+        for idx, key in enumerate(posedict_keys):
+            if key in posedict:
+                mask[row, idx] = True
+    return pose_matrix, mask
+
 # --------------------------------------------------------------------------------
 # TODO: move the image utils to the lower-level `tha3.util`?
 
@@ -178,18 +197,24 @@ def to_talkinghead_image(image: PIL.Image, new_size: Tuple[int] = (512, 512)) ->
 # --------------------------------------------------------------------------------
 
 class RunningAverage:
-    """A simple running average, for things like FPS (frames per second) counters."""
+    """A simple running average, for things like FPS (frames per second) counters.
+
+    The datapoints are kept in a fixed-size ring buffer, so adding a datapoint (typically done every frame)
+    is cheap. The average (typically read only for a log message every few seconds) is computed on demand.
+    """
     def __init__(self):
-        self.count = 100
-        self.data = []
+        self.count = 256  # must be a power of two
+        self.data = np.zeros(self.count, dtype=np.float64)
+        self._index = 0  # where to write the next datapoint
+        self._n = 0  # how many datapoints we have, up to `self.count`
 
     def add_datapoint(self, data: float) -> None:
-        self.data.append(data)
-        while len(self.data) > self.count:
-            del self.data[0]
+        self.data[self._index] = data
+        self._index = (self._index + 1) & (self.count - 1)
+        self._n = min(self._n + 1, self.count)
 
     def average(self) -> float:
-        if len(self.data) == 0:
+        if self._n == 0:
             return 0.0
         else:
-            return sum(self.data) / len(self.data)
+            return float(np.mean(self.data[:self._n]))
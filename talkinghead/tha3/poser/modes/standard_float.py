@@ -61,6 +61,8 @@ class FiveStepPoserComputationProtocol(CachedComputationProtocol):
                  outputs: Dict[str, List[Tensor]]):
             if self.cached_batch_0 is None:
                 new_batch_0 = True
+            elif batch[0] is self.cached_batch_0:  # same tensor as last time, no need to compare the contents
+                new_batch_0 = False
             elif batch[0].shape[0] != self.cached_batch_0.shape[0]:
                 new_batch_0 = True
             else: